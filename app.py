@@ -1,14 +1,473 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import yfinance as yf
+import pyarrow as pa
 from datetime import datetime, timedelta
 import io
+import hashlib
+from importlib.util import find_spec
 from portfolio_analyzer import PortfolioAnalyzer
-from technical_indicators import calculate_macd
+from market_data import fetch_symbol_history, load_history, prefetch_history
+from technical_indicators import calculate_macd, calculate_macd_signals
+
+# Summary columns feeding the allocation charts
+ALLOCATION_CHART_COLUMNS = ['Symbol', 'Weight', 'Weight (%)', 'P&L %', 'Cost (£)', 'P&L (£)']
+
+# Pixel height of a table row (adjust based on font/spacing)
+ROW_HEIGHT = 35
+
+# Rows shown before the holdings table scrolls (the grid virtualizes rows beyond this)
+MAX_VISIBLE_HOLDINGS = 20
+
+
+@st.cache_resource(ttl=3600, max_entries=16, show_spinner=False)
+def get_analyzer(file_hash, _portfolio_df):
+    """
+    Build the portfolio analyzer once per uploaded file and share it across reruns and sessions
+
+    Only the most recent uploads are kept, so a long-running server doesn't hold on to
+    an analyzer for every file it has ever seen.
+
+    Args:
+        file_hash (str): Digest of the uploaded file contents, used as the cache key
+        _portfolio_df (pd.DataFrame): Uploaded portfolio holdings (not hashed)
+
+    Returns:
+        PortfolioAnalyzer: Analyzer for the holdings
+    """
+    return PortfolioAnalyzer(_portfolio_df)
+
+
+class SummaryUnavailableError(Exception):
+    """Raised when market data couldn't be fetched for the portfolio summary"""
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_portfolio_summary(file_hash, _portfolio_df):
+    """
+    Build the portfolio summary, reusing the result across reruns for the same uploaded file
+
+    Keying on the file digest avoids hashing the whole DataFrame on every widget interaction.
+    A failed or all-fallback summary raises SummaryUnavailableError instead of being
+    returned, since Streamlit doesn't cache exceptions and the next rerun retries the fetch.
+
+    Args:
+        file_hash (str): Digest of the uploaded file contents, used as the cache key
+        _portfolio_df (pd.DataFrame): Uploaded portfolio holdings (not hashed)
+
+    Returns:
+        pd.DataFrame: Portfolio summary with current market data
+    """
+    summary = get_analyzer(file_hash, _portfolio_df).get_portfolio_summary()
+    if summary is None or summary.empty:
+        raise SummaryUnavailableError("Portfolio summary could not be built")
+    # Every price falling back to 0 means the price download failed
+    if 'Current Price' in summary.columns and not (summary['Current Price'] > 0).any():
+        raise SummaryUnavailableError("No current prices were fetched")
+    return summary
+
+
+def read_excel_upload(uploaded_file):
+    """
+    Read an uploaded Excel file with the fastest parser available
+
+    Uses the Rust calamine parser when python-calamine is installed, otherwise falls back
+    to pandas' default engine (which already opens xlsx workbooks read-only).
+
+    Args:
+        uploaded_file: Uploaded xlsx or xls file
+
+    Returns:
+        pd.DataFrame: Worksheet rows with the first row as the header
+    """
+    if find_spec("python_calamine") is not None:
+        return pd.read_excel(uploaded_file, engine='calamine')
+    return pd.read_excel(uploaded_file)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_macd(symbol, period, interval):
+    """
+    Calculate MACD on the closing prices of a symbol, cached alongside its history
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+
+    Returns:
+        pd.DataFrame: MACD, Signal and Histogram columns
+        None: If there are not enough data points
+    """
+    return calculate_macd(load_history(symbol, period, interval)['Close'])
+
+
+def load_macd(symbol, period, interval):
+    """
+    Calculate MACD for a symbol, skipping the cache when no history could be fetched
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+
+    Returns:
+        pd.DataFrame: MACD, Signal and Histogram columns
+        None: If there is no history or not enough data points
+    """
+    if load_history(symbol, period, interval).empty:
+        return None
+    return _load_macd(symbol, period, interval)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_macd_signals(symbols, period, interval):
+    """
+    Work out the latest MACD crossover state for symbols that all have history
+
+    Args:
+        symbols (tuple): Stock ticker symbols with non-empty history
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+
+    Returns:
+        pd.Series: True where the latest MACD is above its signal line, indexed by symbol
+    """
+    # Line every symbol's closes up as columns of one price matrix
+    closes = {symbol: load_history(symbol, period, interval)['Close'] for symbol in symbols}
+    return calculate_macd_signals(pd.DataFrame(closes))
+
+
+def load_macd_signals(symbols, period, interval):
+    """
+    Work out the latest MACD crossover state for every portfolio symbol at once
+
+    Symbols whose history came back empty are left out of the cache key, so the result
+    is recomputed once their history can be fetched again.
+
+    Args:
+        symbols (tuple): Stock ticker symbols
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+
+    Returns:
+        pd.Series: True where the latest MACD is above its signal line, indexed by symbol
+    """
+    prefetch_history(symbols, period, (interval,))
+    available = tuple(symbol for symbol in dict.fromkeys(symbols)
+                      if not load_history(symbol, period, interval).empty)
+    return _load_macd_signals(available, period, interval)
+
+
+def top_k_positions(values, k):
+    """
+    Find the row positions of the k largest values, matching nlargest(k, keep='first')
+
+    Args:
+        values (np.ndarray): Values to rank (NaNs only fill the tail, as with nlargest)
+        k (int): Number of positions to return
+
+    Returns:
+        np.ndarray: Positions of the k largest values, largest first (ties in row order)
+    """
+    missing = np.isnan(values)
+    candidates = np.flatnonzero(~missing)
+    # Stable sort keeps tied values in row order; arrays are portfolio-sized, so a full sort is cheap
+    ranked = candidates[np.argsort(-values[candidates], kind='stable')][:k]
+    return np.concatenate([ranked, np.flatnonzero(missing)[:k - len(ranked)]])
+
+
+def downsample(data, max_points=2000):
+    """
+    Thin a series to at most max_points evenly spaced rows before plotting
+
+    Args:
+        data (pd.Series or pd.DataFrame): Time-indexed data
+        max_points (int): Maximum number of rows to keep (default: 2000)
+
+    Returns:
+        pd.Series or pd.DataFrame: Original data if already small enough, otherwise a strided subset
+        that keeps the first and last rows
+    """
+    if len(data) <= max_points:
+        return data
+    idx = np.linspace(0, len(data) - 1, max_points).astype(np.int64)
+    return data.iloc[idx]
+
+
+def histogram_marker(histogram):
+    """
+    Bar marker that colors a MACD histogram green above zero and red below it
+
+    The values are sent as a float32 color array and mapped through a two-step colorscale in
+    the browser, instead of shipping one color string per bar.
+
+    Args:
+        histogram (np.ndarray): MACD histogram values
+
+    Returns:
+        dict: Plotly bar marker settings
+    """
+    values = np.asarray(histogram, dtype=np.float32)
+    max_abs = float(np.nanmax(np.abs(values))) if len(values) else 0.0
+    max_abs = max_abs if max_abs > 0 else 1.0
+    return dict(
+        color=values,
+        colorscale=[[0, 'red'], [0.5, 'red'], [0.5, 'green'], [1, 'green']],
+        cmin=-max_abs,
+        cmax=max_abs,
+        showscale=False
+    )
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def build_macd_figure(symbol, period):
+    """
+    Build the price and MACD chart for a symbol, cached as Plotly JSON per (symbol, period)
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+
+    Returns:
+        str: Plotly figure JSON
+    """
+    import plotly.graph_objects as go
+
+    hist_data = load_history(symbol, period, "1d")
+    macd_data_wk = load_macd(symbol, period, "1wk")
+    macd_data_mo = load_macd(symbol, period, "1mo")
+
+    # Limit points shipped to the browser, in single precision to halve the payload
+    price_plot = downsample(hist_data['Close']).astype(np.float32)
+    macd_plot_mo = downsample(macd_data_mo).astype(np.float32)
+    macd_plot_wk = downsample(macd_data_wk).astype(np.float32)
+
+    # Bars are daily or coarser, so plain dates are enough for the x axis. Converting each
+    # interval's index once and sharing it across its traces avoids repeating full
+    # timezone-qualified timestamps in the JSON.
+    x_price = price_plot.index.strftime('%Y-%m-%d').to_numpy()
+    x_mo = macd_plot_mo.index.strftime('%Y-%m-%d').to_numpy()
+    x_wk = macd_plot_wk.index.strftime('%Y-%m-%d').to_numpy()
+
+    # Pull each series out as an array once; the histogram feeds both its bars and their colors
+    price_y = price_plot.to_numpy()
+    macd_mo, signal_mo, hist_mo = (macd_plot_mo[col].to_numpy() for col in ('MACD', 'Signal', 'Histogram'))
+    macd_wk, signal_wk, hist_wk = (macd_plot_wk[col].to_numpy() for col in ('MACD', 'Signal', 'Histogram'))
+
+    # Create MACD visualization in a single constructor call: price on top,
+    # monthly MACD in the middle and weekly MACD at the bottom, sharing the x axis
+    subplot_title = dict(x=0.5, xref='paper', yref='paper', xanchor='center', yanchor='bottom',
+                         showarrow=False, font=dict(size=16))
+    fig = go.Figure(
+        data=[
+            # Price chart (WebGL, as it carries the most points)
+            go.Scattergl(x=x_price, y=price_y, name='Price',
+                         line=dict(color='white'), xaxis='x', yaxis='y'),
+            # MACD, signal and histogram - monthly
+            go.Scatter(x=x_mo, y=macd_mo, name='MACD',
+                       line=dict(color='blue'), xaxis='x2', yaxis='y2'),
+            go.Scatter(x=x_mo, y=signal_mo, name='Signal',
+                       line=dict(color='red'), xaxis='x2', yaxis='y2'),
+            go.Bar(x=x_mo, y=hist_mo, name='Histogram',
+                   marker=histogram_marker(hist_mo), xaxis='x2', yaxis='y2'),
+            # MACD, signal and histogram - weekly
+            go.Scatter(x=x_wk, y=macd_wk, name='MACD',
+                       line=dict(color='blue'), xaxis='x3', yaxis='y3'),
+            go.Scatter(x=x_wk, y=signal_wk, name='Signal',
+                       line=dict(color='red'), xaxis='x3', yaxis='y3'),
+            go.Bar(x=x_wk, y=hist_wk, name='Histogram',
+                   marker=histogram_marker(hist_wk), xaxis='x3', yaxis='y3'),
+        ],
+        layout=go.Layout(
+            title=f'MACD Analysis for {symbol}',
+            height=800,
+            showlegend=False,
+            xaxis=dict(anchor='y', matches='x3', showticklabels=False),
+            xaxis2=dict(anchor='y2', matches='x3', showticklabels=False),
+            xaxis3=dict(anchor='y3'),
+            yaxis=dict(anchor='x', domain=[0.7, 1.0], title_text="Price"),
+            yaxis2=dict(anchor='x2', domain=[0.35, 0.65], title_text="Monthly"),
+            yaxis3=dict(anchor='x3', domain=[0.0, 0.3], title_text="Weekly"),
+            annotations=[
+                dict(subplot_title, text=f'{symbol} Price', y=1.0),
+                dict(subplot_title, text='MACD', y=0.65),
+            ]
+        )
+    )
+
+    return fig.to_json()
+
+
+@st.cache_data(ttl=900, show_spinner=False)
+def build_allocation_figures(chart_data):
+    """
+    Build the weight treemap, weight bar chart and cost vs P&L chart, cached as Plotly JSON
+
+    Args:
+        chart_data (pd.DataFrame): Symbol, Weight, Weight (%), P&L %, Cost (£) and P&L (£) per holding
+
+    Returns:
+        tuple: Treemap, weight bar and P&L bar figure JSON
+    """
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    # Chart values only need single precision, which halves the payload sent to the browser
+    chart_df = chart_data.astype(
+        {col: 'float32' for col in ['Weight', 'Weight (%)', 'P&L %', 'Cost (£)', 'P&L (£)']
+         if col in chart_data.columns}
+    )
+
+    # Create treemap for portfolio weights: a flat hierarchy with every holding at the top level
+    fig_treemap = go.Figure(go.Treemap(
+        labels=chart_df['Symbol'].to_numpy(),
+        parents=np.full(len(chart_df), ''),
+        values=chart_df['Weight'].to_numpy(),
+        # title="Portfolio Holdings by Weight",
+        marker=dict(
+            colors=chart_df['P&L %'].to_numpy(),
+            colorscale=[[0, 'red'], [1, 'green']],  # red = negative, green = positive
+            showscale=True,
+            colorbar=dict(title=dict(text='P&L %'))
+        ),
+        # Fixed formats, as float32 values would otherwise hover with artefacts like 29.3799991607666
+        hovertemplate='Symbol=%{label}<br>Portfolio Weight=%{value:.2%}<br>P&L %=%{color:.2f}<extra></extra>'
+    ))
+
+    fig_treemap.update_layout(
+        height=500,
+        font_size=12
+    )
+
+    # Bar chart for weights
+    weight_order = np.argsort(-chart_df['Weight (%)'].to_numpy())
+    fig_bar = px.bar(
+        chart_df.iloc[weight_order],
+        x='Symbol',
+        y='Weight (%)',
+        title="Holdings by Weight",
+        labels={'Weight (%)': 'Portfolio Weight', 'Symbol': 'Stock Symbol'}
+    )
+    fig_bar.update_xaxes(tickangle=45)
+
+    # Bar chart for pnl vs cost: one trace per series, holdings ordered by current value
+    cost = chart_df['Cost (£)'].to_numpy()
+    pnl = chart_df['P&L (£)'].to_numpy()
+    value_order = np.argsort(-(cost + pnl), kind='stable')
+    pnl_symbols = chart_df['Symbol'].to_numpy()[value_order]
+
+    # Create stacked bar chart
+    fig_pnl = go.Figure(
+        data=[
+            go.Bar(x=pnl_symbols, y=cost[value_order], name='Cost (£)'),
+            go.Bar(x=pnl_symbols, y=pnl[value_order], name='P&L (£)'),
+        ],
+        layout=go.Layout(
+            barmode='relative',
+            title_text="Invest vs P&L",
+            xaxis_title_text='Stock Symbol',
+            yaxis_title_text='Amount (£)'
+        )
+    )
+
+    fig_pnl.update_layout(
+        legend=dict(
+            orientation="h",          # horizontal
+            yanchor="bottom",
+            y=1.02,                   # just above the plot
+            xanchor="center",
+            x=0.5
+        )
+    )
+
+    fig_pnl.update_xaxes(tickangle=45)
+
+    return fig_treemap.to_json(), fig_bar.to_json(), fig_pnl.to_json()
+
+
+@st.fragment
+def holdings_table(summary_table):
+    """
+    Holdings table with its column picker, rerun on its own when the selection changes
+
+    Args:
+        summary_table (pa.Table): Portfolio summary as an Arrow table
+    """
+    # Let the user pick which columns to display
+    columns_to_show = st.multiselect(
+        "Select columns to display:",
+        options=summary_table.column_names,  # all available columns
+        default=["Symbol", "Company Name", "Current Price", "Currency", "Daily Change (%)", "Weight (%)", "Outlook", "Confidence"]  # pre-selected defaults
+    )
+
+    st.dataframe(
+        summary_table.select(columns_to_show),
+        height=(min(summary_table.num_rows, MAX_VISIBLE_HOLDINGS) + 1) * ROW_HEIGHT,
+        use_container_width=True,
+        hide_index=True
+    )
+
+
+@st.fragment
+def macd_section(symbols):
+    """
+    Render the MACD symbol picker, chart and insights
+
+    Runs as a fragment, so picking a symbol or generating a chart reruns only this section
+    rather than the portfolio overview and allocation charts above it.
+
+    Args:
+        symbols (tuple): Portfolio symbols available for analysis, in alphabetical order
+    """
+    import plotly.io as pio
+
+    selected_symbol = st.selectbox(
+        "Select a symbol for MACD analysis:",
+        symbols,  # ✅ already in alphabetical order
+        help="Choose a stock symbol from your portfolio to analyze MACD trends"
+    )
+
+    if st.button("Generate MACD Analysis", type="primary"):
+        with st.spinner(f"Analyzing MACD for {selected_symbol}..."):
+            try:
+                # Fetch the selected symbol's daily, weekly and monthly history concurrently
+                period = "5y"
+                fetch_symbol_history(selected_symbol, period, ("1d", "1wk", "1mo"))
+                hist_data = load_history(selected_symbol, period, "1d")
+
+                if not hist_data.empty:
+                    # Calculate MACD
+                    macd_data = load_macd(selected_symbol, period, "1d")
+
+                    if macd_data is not None:
+                        fig = pio.from_json(build_macd_figure(selected_symbol, period))
+                        st.plotly_chart(fig, use_container_width=True)
+
+                        # MACD insights
+                        st.subheader("MACD Insights")
+
+                        # Signal interpretation (computed for the whole portfolio at once)
+                        monthly_signals = load_macd_signals(symbols, period, "1mo")
+                        if selected_symbol not in monthly_signals.index:
+                            st.info("Not enough monthly data to interpret the MACD signal.")
+                        elif monthly_signals[selected_symbol]:
+                            st.success("🟢 **Bullish Signal**: MACD is above the signal line, indicating potential upward momentum.")
+                        else:
+                            st.error("🔴 **Bearish Signal**: MACD is below the signal line, indicating potential downward momentum.")
+
+                        # With the chart on screen, batch the rest of the portfolio into the disk
+                        # cache (one request per interval) so other symbols load quickly
+                        prefetch_history(symbols, period, ("1d", "1wk"))
+
+                    else:
+                        st.error("Failed to calculate MACD. Insufficient data points.")
+                else:
+                    st.error(f"No historical data found for {selected_symbol}")
+
+            except Exception as e:
+                st.error(f"Error analyzing MACD for {selected_symbol}: {str(e)}")
+
 
 # Page configuration
 st.set_page_config(
@@ -24,6 +483,8 @@ if 'portfolio_data' not in st.session_state:
     st.session_state.portfolio_data = None
 if 'analyzer' not in st.session_state:
     st.session_state.analyzer = None
+if 'portfolio_hash' not in st.session_state:
+    st.session_state.portfolio_hash = None
 
 # Sidebar for file upload and controls
 st.sidebar.header("Upload Portfolio Data")
@@ -36,14 +497,24 @@ uploaded_file = st.sidebar.file_uploader(
 
 if uploaded_file is not None:
     try:
-        # Read the file based on its extension
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
+        # Digest of the raw upload keys the cached analyzer and summary
+        file_hash = hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
+
+        # Only parse the file when its contents changed since the last rerun
+        if st.session_state.portfolio_hash != file_hash or st.session_state.portfolio_data is None:
+            # Read the file based on its extension
+            if uploaded_file.name.endswith('.csv'):
+                df = pd.read_csv(uploaded_file, engine='pyarrow', dtype_backend='pyarrow')
+            else:
+                df = read_excel_upload(uploaded_file)
+            
+            # Validate before storing so an invalid upload is re-checked on every rerun
+            analyzer = get_analyzer(file_hash, df)
+            st.session_state.portfolio_data = df
+            st.session_state.portfolio_hash = file_hash
+            st.session_state.analyzer = analyzer
         else:
-            df = pd.read_excel(uploaded_file)
-        
-        st.session_state.portfolio_data = df
-        st.session_state.analyzer = PortfolioAnalyzer(df)
+            df = st.session_state.portfolio_data
         
         st.sidebar.success(f"✅ File uploaded successfully! Found {len(df)} holdings.")
         
@@ -52,31 +523,44 @@ if uploaded_file is not None:
         st.sidebar.dataframe(df.head())
         
     except Exception as e:
+        # Drop any previous portfolio so the main area doesn't keep showing it
+        st.session_state.portfolio_data = None
+        st.session_state.portfolio_hash = None
+        st.session_state.analyzer = None
         st.sidebar.error(f"❌ Error reading file: {str(e)}")
         st.sidebar.info("Please ensure your file has columns like 'Slice'/'Symbol', 'Owned quantity'/'Shares' or 'Weight'")
 
 # Main content area
 if st.session_state.portfolio_data is not None and st.session_state.analyzer is not None:
-    analyzer = st.session_state.analyzer
+    # Plotly is only needed once a portfolio is loaded, so keep it off the cold-start path
+    import plotly.io as pio
     
     # Portfolio Overview Section
     st.header("📊 Portfolio Overview")
     
     with st.spinner("Fetching current market data..."):
         try:
-            portfolio_summary = analyzer.get_portfolio_summary()
+            try:
+                portfolio_summary = load_portfolio_summary(
+                    st.session_state.portfolio_hash, st.session_state.portfolio_data)
+            except SummaryUnavailableError:
+                portfolio_summary = None
             
             if portfolio_summary is not None and not portfolio_summary.empty:
+                # Pull the metric columns out as one array and reduce them together
+                # (missing columns come through as NaN and sum to 0)
+                metric_values = portfolio_summary.reindex(
+                    columns=['Value (£)', 'Cost (£)', 'Weight']).to_numpy(dtype=float)
+                total_value, total_cost, _ = np.nansum(metric_values, axis=0)
+                pnl_pct = portfolio_summary["P&L %"].to_numpy(dtype=float)
+                
                 # Display key metrics
                 col1, col2, col3, col4 = st.columns(4)
                 
                 with col1:
-                    total_value = portfolio_summary['Value (£)'].sum() if 'Value (£)' in portfolio_summary.columns else 0
                     st.metric("Total Portfolio Value", f"£{total_value:,.2f}")
 
                 with col2:
-                    total_value = portfolio_summary['Value (£)'].sum() if 'Value (£)' in portfolio_summary.columns else 0
-                    total_cost = portfolio_summary['Cost (£)'].sum() if 'Cost (£)' in portfolio_summary.columns else 0
                     pnl = ((total_value-total_cost)/total_cost) * 100
                     st.metric("P&L %", f"{pnl:.2f}%")
                 
@@ -86,28 +570,14 @@ if st.session_state.portfolio_data is not None and st.session_state.analyzer is
             
                 with col4:
                     if 'Weight' in portfolio_summary.columns:
-                        max_weight = portfolio_summary['Weight'].max() * 100
+                        max_weight = np.nanmax(metric_values[:, 2]) * 100
                         st.metric("Largest Position", f"{max_weight:.1f}%")
                     else:
                         st.metric("Largest Position", "N/A")
                 
                 # Display detailed holdings table
                 st.subheader("Holdings Details")
-                row_height = 35  # adjust based on font/spacing
-
-                # Let the user pick which columns to display
-                columns_to_show = st.multiselect(
-                    "Select columns to display:",
-                    options=portfolio_summary.columns.tolist(),  # all available columns
-                    default=["Symbol", "Company Name", "Current Price", "Currency", "Daily Change (%)", "Weight (%)", "Outlook", "Confidence"]  # pre-selected defaults
-                )
-                
-                st.dataframe(
-                    portfolio_summary[columns_to_show],
-                    height=(len(df) + 1) * row_height,
-                    use_container_width=True,
-                    hide_index=True
-                )
+                holdings_table(pa.Table.from_pandas(portfolio_summary, preserve_index=False))
 
                 # Top & Bottom 5
                 st.header("🏆 / 💔 - Top 5 Winners vs Losers")
@@ -115,19 +585,19 @@ if st.session_state.portfolio_data is not None and st.session_state.analyzer is
                 top5_cols_to_show=["Symbol", "Company Name", "P&L %"]
                 
                 with col1:
-                    top5_df = portfolio_summary.nlargest(5, "P&L %")  # top 5 rows by P&L %
+                    top5_df = portfolio_summary.iloc[top_k_positions(pnl_pct, 5)]  # top 5 rows by P&L %
                     st.dataframe(
                         top5_df[top5_cols_to_show],
-                        height=6 * row_height,
+                        height=6 * ROW_HEIGHT,
                         use_container_width=True,
                         hide_index=True
                     )
 
                 with col2:
-                    bottom5_df = portfolio_summary.nsmallest(5, "P&L %")  # top 5 rows by P&L %
+                    bottom5_df = portfolio_summary.iloc[top_k_positions(-pnl_pct, 5)]  # bottom 5 rows by P&L %
                     st.dataframe(
                         bottom5_df[top5_cols_to_show],
-                        height=6 * row_height,
+                        height=6 * ROW_HEIGHT,
                         use_container_width=True,
                         hide_index=True
                     )
@@ -136,64 +606,12 @@ if st.session_state.portfolio_data is not None and st.session_state.analyzer is
                 st.header("🔥 Portfolio Weight Heat Map")
                 
                 if 'Weight' in portfolio_summary.columns and 'Symbol' in portfolio_summary.columns:
-                    # Create treemap for portfolio weights
-                    fig_treemap = px.treemap(
-                        portfolio_summary,
-                        path=['Symbol'],
-                        values='Weight',
-                        # title="Portfolio Holdings by Weight",
-                        color='P&L %',
-                        color_continuous_scale=['red', 'green'],  # red = negative, green = positive
-                        labels={'Weight': 'Portfolio Weight'}
-                    )
-                    
-                    fig_treemap.update_layout(
-                        height=500,
-                        font_size=12
+                    fig_treemap, fig_bar, fig_pnl = (
+                        pio.from_json(fig_json)
+                        for fig_json in build_allocation_figures(portfolio_summary[ALLOCATION_CHART_COLUMNS])
                     )
-                    
                     st.plotly_chart(fig_treemap, use_container_width=True)
-                    
-                    # Bar chart for weights
-                    fig_bar = px.bar(
-                        portfolio_summary.sort_values('Weight (%)', ascending=False),
-                        x='Symbol',
-                        y='Weight (%)',
-                        title="Holdings by Weight",
-                        labels={'Weight (%)': 'Portfolio Weight', 'Symbol': 'Stock Symbol'}
-                    )
-                    fig_bar.update_xaxes(tickangle=45)
                     st.plotly_chart(fig_bar, use_container_width=True)
-                    
-                    # Bar chart for pnl vs cost
-                    df_melted = portfolio_summary.melt(
-                        id_vars=['Symbol'], 
-                        value_vars=['Cost (£)', 'P&L (£)'], 
-                        var_name='Type', 
-                        value_name='Amount'
-                    )
-
-                    # Create stacked bar chart
-                    fig_pnl = px.bar(
-                        df_melted.sort_values('Amount', ascending=False),
-                        x='Symbol',
-                        y='Amount',
-                        color='Type',           # distinguishes Cost vs P&L
-                        title="Invest vs P&L",
-                        labels={'Amount': 'Amount (£)', 'Symbol': 'Stock Symbol', 'Type': ''}
-                    )
-
-                    fig_pnl.update_layout(
-                        legend=dict(
-                            orientation="h",          # horizontal
-                            yanchor="bottom",
-                            y=1.02,                   # just above the plot
-                            xanchor="center",
-                            x=0.5
-                        )
-                    )
-                    
-                    fig_pnl.update_xaxes(tickangle=45)
                     st.plotly_chart(fig_pnl, use_container_width=True)
                 
                 else:
@@ -202,154 +620,11 @@ if st.session_state.portfolio_data is not None and st.session_state.analyzer is
                 # MACD Analysis Section
                 st.header("📈 MACD Technical Analysis")
                 
-                # Symbol selection for MACD analysis
-                symbols = portfolio_summary['Symbol'].tolist() if 'Symbol' in portfolio_summary.columns else []
+                # Symbol selection for MACD analysis, sorted once here rather than on every fragment rerun
+                symbols = tuple(sorted(portfolio_summary['Symbol'])) if 'Symbol' in portfolio_summary.columns else ()
                 
                 if symbols:
-                    selected_symbol = st.selectbox(
-                        "Select a symbol for MACD analysis:",
-                        sorted(symbols),  # ✅ ensures alphabetical order
-                        help="Choose a stock symbol from your portfolio to analyze MACD trends"
-                    )
-                    
-                    if st.button("Generate MACD Analysis", type="primary"):
-                        with st.spinner(f"Analyzing MACD for {selected_symbol}..."):
-                            try:
-                                # Fetch historical data
-                                period = "5y"
-                                ticker = yf.Ticker(selected_symbol)
-                                hist_data = ticker.history(period=period, interval="1d")
-                                hist_data_wk = ticker.history(period=period, interval="1wk")
-                                hist_data_mo = ticker.history(period=period, interval="1mo")
-                                
-                                if not hist_data.empty:
-                                    # Calculate MACD
-                                    macd_data = calculate_macd(hist_data['Close'])
-                                    macd_data_wk = calculate_macd(hist_data_wk['Close'])
-                                    macd_data_mo = calculate_macd(hist_data_mo['Close'])
-                                    
-                                    if macd_data is not None:
-                                        # Create MACD visualization
-                                        fig = make_subplots(
-                                            rows=3, cols=1,
-                                            shared_xaxes=True,
-                                            vertical_spacing=0.05,
-                                            subplot_titles=(
-                                                f'{selected_symbol} Price',
-                                                'MACD'
-                                            ),
-                                            row_heights=[0.5, 0.5, 0.5]
-                                        )
-                                        
-                                        # Price chart
-                                        fig.add_trace(
-                                            go.Scatter(
-                                                x=hist_data.index,
-                                                y=hist_data['Close'],
-                                                name='Price',
-                                                line=dict(color='white')
-                                            ),
-                                            row=1, col=1
-                                        )
-                                        
-                                        # MACD line - monthly
-                                        fig.add_trace(
-                                            go.Scatter(
-                                                x=macd_data_mo.index,
-                                                y=macd_data_mo['MACD'],
-                                                name='MACD',
-                                                line=dict(color='blue')
-                                            ),
-                                            row=2, col=1
-                                        )
-                                        
-                                        # Signal line - monthly
-                                        fig.add_trace(
-                                            go.Scatter(
-                                                x=macd_data_mo.index,
-                                                y=macd_data_mo['Signal'],
-                                                name='Signal',
-                                                line=dict(color='red')
-                                            ),
-                                            row=2, col=1
-                                        )
-                                        
-                                        # MACD histogram - monthly
-                                        colors = ['green' if val >= 0 else 'red' for val in macd_data_mo['Histogram']]
-                                        fig.add_trace(
-                                            go.Bar(
-                                                x=macd_data_mo.index,
-                                                y=macd_data_mo['Histogram'],
-                                                name='Histogram',
-                                                marker_color=colors
-                                            ),
-                                            row=2, col=1
-                                        )
-                                        
-                                        # MACD line - weekly
-                                        fig.add_trace(
-                                            go.Scatter(
-                                                x=macd_data_wk.index,
-                                                y=macd_data_wk['MACD'],
-                                                name='MACD',
-                                                line=dict(color='blue')
-                                            ),
-                                            row=3, col=1
-                                        )
-
-                                        # Signal line - weekly
-                                        fig.add_trace(
-                                            go.Scatter(
-                                                x=macd_data_wk.index,
-                                                y=macd_data_wk['Signal'],
-                                                name='Signal',
-                                                line=dict(color='red')
-                                            ),
-                                            row=3, col=1
-                                        )
-
-                                        # MACD histogram - weekly
-                                        colors = ['green' if val >= 0 else 'red' for val in macd_data_wk['Histogram']]
-                                        fig.add_trace(
-                                            go.Bar(
-                                                x=macd_data_wk.index,
-                                                y=macd_data_wk['Histogram'],
-                                                name='Histogram',
-                                                marker_color=colors
-                                            ),
-                                            row=3, col=1
-                                        )
-                                        
-                                        fig.update_layout(
-                                            title=f'MACD Analysis for {selected_symbol}',
-                                            height=800,
-                                            showlegend=False
-                                        )
-
-                                        fig.update_yaxes(title_text="Price", row=1, col=1)
-                                        fig.update_yaxes(title_text="Monthly", row=2, col=1)
-                                        fig.update_yaxes(title_text="Weekly", row=3, col=1)
-                                        
-                                        st.plotly_chart(fig, use_container_width=True)
-                                        
-                                        # MACD insights
-                                        st.subheader("MACD Insights")
-                                        
-                                        latest_macd = macd_data_mo.iloc[-1]
-                                        
-                                        # Signal interpretation
-                                        if latest_macd['MACD'] > latest_macd['Signal']:
-                                            st.success("🟢 **Bullish Signal**: MACD is above the signal line, indicating potential upward momentum.")
-                                        else:
-                                            st.error("🔴 **Bearish Signal**: MACD is below the signal line, indicating potential downward momentum.")
-                                        
-                                    else:
-                                        st.error("Failed to calculate MACD. Insufficient data points.")
-                                else:
-                                    st.error(f"No historical data found for {selected_symbol}")
-                                    
-                            except Exception as e:
-                                st.error(f"Error analyzing MACD for {selected_symbol}: {str(e)}")
+                    macd_section(symbols)
                 
                 else:
                     st.warning("No symbols available for MACD analysis. Please check your portfolio data.")
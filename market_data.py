@@ -0,0 +1,297 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import streamlit as st
+from pathlib import Path
+
+# Directory for price history persisted between app restarts
+CACHE_DIR = Path(".cache")
+
+# Concurrent interval requests when fetching one symbol's history (daily, weekly, monthly)
+HISTORY_FETCH_WORKERS = 3
+
+# Seconds before a cached history file is considered stale and re-downloaded
+HISTORY_CACHE_TTL = 60 * 60
+
+# Seconds before cached company details (name, sector, ...) are refreshed
+PROFILE_CACHE_TTL = 24 * 60 * 60
+
+
+def _history_cache_path(symbol, period, interval):
+    """Parquet file holding the history for a (symbol, period, interval) request"""
+    safe_symbol = symbol.replace("/", "-")
+    return CACHE_DIR / f"{safe_symbol}_{period}_{interval}.parquet"
+
+
+def _profile_cache_path(symbol):
+    """JSON file holding the company details for a symbol"""
+    safe_symbol = symbol.replace("/", "-")
+    return CACHE_DIR / "profiles" / f"{safe_symbol}.json"
+
+
+def _is_fresh(path, ttl=HISTORY_CACHE_TTL):
+    """Whether a cache file exists and was written within ttl seconds"""
+    try:
+        return time.time() - path.stat().st_mtime < ttl
+    except OSError:
+        return False
+
+
+def read_cached_history(symbol, period, interval):
+    """
+    Read price history from the on-disk cache if it is still within its TTL
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+
+    Returns:
+        pd.DataFrame: Cached OHLCV history
+        None: If nothing fresh is cached or the file cannot be read
+    """
+    path = _history_cache_path(symbol, period, interval)
+    if not _is_fresh(path):
+        return None
+
+    try:
+        return pd.read_parquet(path)
+    except Exception as e:
+        print(f"Error reading cached history for {symbol}: {e}")
+        return None
+
+
+def write_cached_history(symbol, period, interval, hist_data):
+    """
+    Save price history to the on-disk cache
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+        hist_data (pd.DataFrame): OHLCV history to store
+    """
+    if hist_data is None or hist_data.empty:
+        return
+
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        hist_data.to_parquet(_history_cache_path(symbol, period, interval), compression="zstd")
+    except Exception as e:
+        print(f"Error caching history for {symbol}: {e}")
+
+
+def read_cached_profile(symbol):
+    """
+    Read company details saved within the last PROFILE_CACHE_TTL seconds
+
+    Args:
+        symbol (str): Stock ticker symbol
+
+    Returns:
+        dict: Cached company details
+        None: If nothing fresh is cached or the file cannot be read
+    """
+    path = _profile_cache_path(symbol)
+    if not _is_fresh(path, PROFILE_CACHE_TTL):
+        return None
+
+    try:
+        return json.loads(path.read_text())
+    except Exception as e:
+        print(f"Error reading cached profile for {symbol}: {e}")
+        return None
+
+
+def write_cached_profile(symbol, profile):
+    """
+    Save company details to the on-disk cache
+
+    Args:
+        symbol (str): Stock ticker symbol
+        profile (dict): JSON-serializable company details
+    """
+    try:
+        path = _profile_cache_path(symbol)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(profile))
+    except Exception as e:
+        print(f"Error caching profile for {symbol}: {e}")
+
+
+def download_history(symbol, period, interval):
+    """
+    Download price history for a symbol from Yahoo and save it to the on-disk cache
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+
+    Returns:
+        pd.DataFrame: OHLCV history
+    """
+    import yfinance as yf
+    hist_data = yf.Ticker(symbol).history(period=period, interval=interval)
+    write_cached_history(symbol, period, interval, hist_data)
+    return hist_data
+
+
+class EmptyHistoryError(Exception):
+    """Raised when Yahoo returns no price history for a symbol"""
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_history(symbol, period, interval):
+    """
+    Fetch price history for a symbol, raising on an empty result so it isn't memoized
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+
+    Returns:
+        pd.DataFrame: OHLCV history
+    """
+    hist_data = read_cached_history(symbol, period, interval)
+    if hist_data is None:
+        hist_data = download_history(symbol, period, interval)
+    if hist_data.empty:
+        raise EmptyHistoryError(symbol)
+    return hist_data
+
+
+def load_history(symbol, period, interval):
+    """
+    Fetch price history for a symbol, cached in memory and on disk per (symbol, period, interval)
+
+    Empty results (usually a transient download failure) are not cached, so the next
+    call tries Yahoo again.
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+        interval (str): Bar interval (e.g. "1d", "1wk", "1mo")
+
+    Returns:
+        pd.DataFrame: OHLCV history (empty if none was returned)
+    """
+    try:
+        return _load_history(symbol, period, interval)
+    except EmptyHistoryError:
+        return pd.DataFrame()
+
+
+def fetch_symbol_history(symbol, period, intervals):
+    """
+    Download a symbol's history for several intervals concurrently, skipping fresh disk entries
+
+    Each interval is its own Ticker.history() request, so the daily, weekly and monthly bars
+    arrive side by side rather than one after another. Later load_history() calls for the
+    symbol are then served from disk.
+
+    Args:
+        symbol (str): Stock ticker symbol
+        period (str): History period (e.g. "5y")
+        intervals (tuple): Bar intervals (e.g. ("1d", "1wk", "1mo"))
+    """
+    missing = [interval for interval in intervals
+               if not _is_fresh(_history_cache_path(symbol, period, interval))]
+    if not missing:
+        return
+
+    def fetch(interval):
+        try:
+            download_history(symbol, period, interval)
+        except Exception as e:
+            print(f"Error fetching {interval} history for {symbol}: {e}")
+
+    with ThreadPoolExecutor(max_workers=min(HISTORY_FETCH_WORKERS, len(missing))) as executor:
+        list(executor.map(fetch, missing))
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def prefetch_history(symbols, period, intervals):
+    """
+    Download history for every symbol not yet cached on disk, one batched request per interval
+
+    Later load_history() calls for these symbols are then served from the disk cache instead of
+    issuing one request per symbol. The batches run one after another, as yf.download() keeps
+    its results in module-level state and can't safely run concurrently.
+
+    Args:
+        symbols (tuple): Stock ticker symbols
+        period (str): History period (e.g. "5y")
+        intervals (tuple): Bar intervals (e.g. ("1d", "1wk", "1mo"))
+    """
+    import yfinance as yf
+
+    for interval in intervals:
+        missing = [symbol for symbol in dict.fromkeys(symbols)
+                   if not _is_fresh(_history_cache_path(symbol, period, interval))]
+        if not missing:
+            continue
+
+        try:
+            data = yf.download(missing, period=period, interval=interval, group_by='ticker',
+                               auto_adjust=True, threads=True, progress=False)
+        except Exception as e:
+            print(f"Error prefetching {interval} history: {e}")
+            continue
+
+        if data is None or data.empty:
+            continue
+
+        downloaded = set(data.columns.get_level_values(0))
+        for symbol in missing:
+            if symbol in downloaded:
+                write_cached_history(symbol, period, interval, data[symbol].dropna(how='all'))
+
+
+def load_daily_histories(tickers, start):
+    """
+    Fetch daily history since a start date for several tickers, reusing the on-disk cache
+
+    Tickers cached within HISTORY_CACHE_TTL are read from disk; the rest are downloaded in one
+    threaded batch and written back.
+
+    Args:
+        tickers (list): Stock ticker symbols
+        start (str): First date of history (e.g. "2021-01-01")
+
+    Returns:
+        dict: Ticker to OHLCV history, omitting tickers that couldn't be fetched
+    """
+    tickers = list(dict.fromkeys(tickers))
+
+    # Reuse daily history cached on disk within its TTL; only the rest needs downloading
+    cache_period = f"from-{start}"
+    histories = {}
+    for ticker in tickers:
+        cached = read_cached_history(ticker, cache_period, "1d")
+        if cached is not None:
+            histories[ticker] = cached
+    missing = [ticker for ticker in tickers if ticker not in histories]
+    if not missing:
+        return histories
+
+    # Fetch the missing tickers in one threaded batch rather than one request at a time
+    import yfinance as yf
+    try:
+        data = yf.download(missing, start=start, group_by='ticker', auto_adjust=True,
+                           threads=True, progress=False)
+    except Exception as e:
+        print(f"Error downloading price history: {e}")
+        return histories
+
+    if data is None or data.empty:
+        return histories
+
+    downloaded = set(data.columns.get_level_values(0))
+    for ticker in missing:
+        if ticker in downloaded:
+            histories[ticker] = data[ticker].dropna(how='all')
+            write_cached_history(ticker, cache_period, "1d", histories[ticker])
+    return histories
@@ -1,9 +1,36 @@
+import re
 import pandas as pd
 import numpy as np
-import yfinance as yf
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 from technical_indicators import analyze_tickers
+from market_data import load_daily_histories, read_cached_profile, write_cached_profile
+
+# Summary columns rounded to two decimals for display (missing ones are ignored)
+ROUNDED_COLUMNS = ['Current Price', 'Previous Close', 'Market Value', 'Weight (%)',
+                   'Daily Change (%)', 'P&L %', 'P&L (£)']
+
+# Holding columns that add up when a symbol appears on several rows
+ADDITIVE_COLUMNS = ['Shares', 'Weight', 'Current Value', 'Cost (£)', 'Value (£)', 'P&L (£)']
+
+# Accepted spellings of the symbol, shares and weight columns, in order of preference
+SYMBOL_COLUMN_ALIASES = ('symbol', 'ticker', 'Ticker', 'SYMBOL', 'Stock', 'stock', 'Slice')
+SHARES_COLUMN_ALIASES = ('shares', 'quantity', 'Quantity', 'SHARES', 'Amount', 'amount', 'Owned quantity')
+WEIGHT_COLUMN_ALIASES = ('weight', 'Weight', 'WEIGHT', 'Allocation', 'allocation', '%')
+
+# Slice labels marking summary rows (like "Total" rows) rather than holdings
+SUMMARY_ROW_PATTERN = re.compile('Total|TOTAL|total|Summary|SUMMARY|summary')
+
+# Ticker.info fields kept as the company profile (prices come from the batched download)
+PROFILE_FIELDS = ['longName', 'sector', 'industry', 'currency', 'marketCap']
+
+# Concurrent per-symbol info requests (kept modest to stay under Yahoo's rate limit)
+INFO_FETCH_WORKERS = 8
+
+def _first_present(columns, aliases):
+    """Return the first alias found in a set of column names, or None"""
+    return next((alias for alias in aliases if alias in columns), None)
 
 class PortfolioAnalyzer:
     def __init__(self, portfolio_df):
@@ -22,63 +49,67 @@ class PortfolioAnalyzer:
         if 'Slice' in self.portfolio_df.columns:
             # Filter out summary rows where Slice contains "Total" or similar
             self.portfolio_df = self.portfolio_df[
-                ~self.portfolio_df['Slice'].astype(str).str.contains('Total|TOTAL|total|Summary|SUMMARY|summary', na=False)
+                ~self.portfolio_df['Slice'].astype(str).str.contains(SUMMARY_ROW_PATTERN, na=False)
             ]
         
+        columns = set(self.portfolio_df.columns)
+        
         # Ensure we have required columns
-        if 'Symbol' not in self.portfolio_df.columns:
+        if 'Symbol' not in columns:
             # Try common variations including user's format
-            symbol_columns = ['symbol', 'ticker', 'Ticker', 'SYMBOL', 'Stock', 'stock', 'Slice']
-            for col in symbol_columns:
-                if col in self.portfolio_df.columns:
-                    self.portfolio_df['Symbol'] = self.portfolio_df[col]
-                    break
-            else:
+            symbol_column = _first_present(columns, SYMBOL_COLUMN_ALIASES)
+            if symbol_column is None:
                 raise ValueError("No symbol column found. Please include a 'Symbol' or 'Slice' column with stock tickers.")
+            self.portfolio_df['Symbol'] = self.portfolio_df[symbol_column]
         
         # Clean up symbol column
         self.portfolio_df['Symbol'] = self.portfolio_df['Symbol'].astype(str).str.strip().str.upper()
         
         # Handle company names if available
-        if 'Name' in self.portfolio_df.columns and 'Company Name' not in self.portfolio_df.columns:
+        if 'Name' in columns and 'Company Name' not in columns:
             self.portfolio_df['Company Name'] = self.portfolio_df['Name']
         
         # Handle shares and weights
-        if 'Shares' not in self.portfolio_df.columns and 'Weight' not in self.portfolio_df.columns:
+        if 'Shares' not in columns and 'Weight' not in columns:
             # Try common variations including user's format
-            shares_columns = ['shares', 'quantity', 'Quantity', 'SHARES', 'Amount', 'amount', 'Owned quantity']
-            weight_columns = ['weight', 'Weight', 'WEIGHT', 'Allocation', 'allocation', '%']
+            shares_column = _first_present(columns, SHARES_COLUMN_ALIASES)
+            weight_column = _first_present(columns, WEIGHT_COLUMN_ALIASES)
             
-            for col in shares_columns:
-                if col in self.portfolio_df.columns:
-                    self.portfolio_df['Shares'] = pd.to_numeric(self.portfolio_df[col], errors='coerce')
-                    break
+            if shares_column is not None:
+                self.portfolio_df['Shares'] = pd.to_numeric(self.portfolio_df[shares_column], errors='coerce')
+            elif weight_column is not None:
+                weights = pd.to_numeric(self.portfolio_df[weight_column], errors='coerce')
+                # Normalize weights if they appear to be percentages
+                if weights.notna().any() and weights.max() > 1:
+                    weights = weights / 100
+                self.portfolio_df['Weight'] = weights
             else:
-                for col in weight_columns:
-                    if col in self.portfolio_df.columns:
-                        weights = pd.to_numeric(self.portfolio_df[col], errors='coerce')
-                        # Normalize weights if they appear to be percentages
-                        if weights.notna().any() and weights.max() > 1:
-                            weights = weights / 100
-                        self.portfolio_df['Weight'] = weights
-                        break
-                else:
-                    # If no shares or weights, assume equal weights
-                    self.portfolio_df['Weight'] = 1.0 / len(self.portfolio_df)
+                # If no shares or weights, assume equal weights
+                self.portfolio_df['Weight'] = 1.0 / len(self.portfolio_df)
+        
+        # add extra columns from csv, converting each source column once
+        numeric = self.portfolio_df[['Invested value', 'Value', 'Result']].apply(pd.to_numeric, errors='coerce')
         
         # Handle current value if available
-        if 'Value' in self.portfolio_df.columns and 'Current Value' not in self.portfolio_df.columns:
-            self.portfolio_df['Current Value'] = pd.to_numeric(self.portfolio_df['Value'], errors='coerce')
-
-        # add extra columns from csv
-        self.portfolio_df['Cost (£)'] = pd.to_numeric(self.portfolio_df['Invested value'], errors='coerce')
-        self.portfolio_df['Value (£)'] = pd.to_numeric(self.portfolio_df['Value'], errors='coerce')
-        self.portfolio_df['P&L (£)'] = pd.to_numeric(self.portfolio_df['Result'], errors='coerce')
+        if 'Current Value' not in columns:
+            self.portfolio_df['Current Value'] = numeric['Value']
+        
+        self.portfolio_df['Cost (£)'] = numeric['Invested value']
+        self.portfolio_df['Value (£)'] = numeric['Value']
+        self.portfolio_df['P&L (£)'] = numeric['Result']
         
         # Remove rows with invalid symbols
         self.portfolio_df = self.portfolio_df.dropna(subset=['Symbol'])
         self.portfolio_df = self.portfolio_df[self.portfolio_df['Symbol'] != '']
         
+        # Merge duplicate symbols (e.g. split broker lots) so each is fetched once
+        if self.portfolio_df['Symbol'].duplicated().any():
+            grouped = self.portfolio_df.groupby('Symbol', sort=False)
+            additive = [col for col in ADDITIVE_COLUMNS if col in self.portfolio_df.columns]
+            merged = grouped.first()
+            merged[additive] = grouped[additive].sum(min_count=1)
+            self.portfolio_df = merged.reset_index()
+        
     def fetch_stock_data(self, symbols):
         """
         Fetch current stock data for given symbols
@@ -90,38 +121,33 @@ class PortfolioAnalyzer:
             dict: Dictionary with symbol as key and stock info as value
         """
         stock_data = {}
+        prices = self.fetch_closing_prices(symbols)
+        
+        # The batched download doubles as a symbol check: only symbols with recent prices
+        # need company details, unknown ones go straight to the fallback below
+        profiles = self.fetch_ticker_profiles([symbol for symbol in symbols if symbol in prices.index])
         
         for symbol in symbols:
-            try:
-                ticker = yf.Ticker(symbol)
-                info = ticker.info
-                hist = ticker.history(interval="1d")
-                
-                if not hist.empty:
-                    current_price = hist['Close'].iloc[-1]
-                    stock_data[symbol] = {
-                        'Current Price': current_price,
-                        'Previous Close': info.get('previousClose', current_price),
-                        'Market Cap': info.get('marketCap', 0),
-                        'Company Name': info.get('longName', symbol),
-                        'Sector': info.get('sector', 'Unknown'),
-                        'Industry': info.get('industry', 'Unknown'),
-                        'Currency': info.get('currency', 'Unknown')
-                    }
-                else:
-                    # Fallback for symbols without recent data
-                    stock_data[symbol] = {
-                        'Current Price': 0,
-                        'Previous Close': 0,
-                        'Market Cap': 0,
-                        'Company Name': symbol,
-                        'Sector': 'Unknown',
-                        'Industry': 'Unknown',
-                        'Currency': 'Unknown'
-                    }
-                    
-            except Exception as e:
-                st.warning(f"Could not fetch data for {symbol}: {str(e)}")
+            profile = profiles.get(symbol)
+            
+            if isinstance(profile, Exception):
+                st.warning(f"Could not fetch data for {symbol}: {str(profile)}")
+                profile = None
+            
+            if profile is not None and symbol in prices.index:
+                current_price = prices.at[symbol, 'Current Price']
+                previous_close = prices.at[symbol, 'Previous Close']
+                stock_data[symbol] = {
+                    'Current Price': current_price,
+                    'Previous Close': current_price if pd.isna(previous_close) else previous_close,
+                    'Market Cap': profile.get('marketCap', 0),
+                    'Company Name': profile.get('longName', symbol),
+                    'Sector': profile.get('sector', 'Unknown'),
+                    'Industry': profile.get('industry', 'Unknown'),
+                    'Currency': profile.get('currency', 'Unknown')
+                }
+            else:
+                # Fallback for symbols without recent data
                 stock_data[symbol] = {
                     'Current Price': 0,
                     'Previous Close': 0,
@@ -134,6 +160,81 @@ class PortfolioAnalyzer:
                 
         return stock_data
     
+    def fetch_ticker_profiles(self, symbols):
+        """
+        Fetch company details (name, sector, industry, currency, market cap) for each symbol
+        
+        Details change rarely, so they are served from a day-long disk cache and only
+        missing symbols hit Yahoo's info endpoint, concurrently.
+        
+        Args:
+            symbols (list): List of stock symbols
+            
+        Returns:
+            dict: Symbol to profile dict, or to the exception raised while fetching it
+        """
+        import yfinance as yf
+        
+        def fetch_profile(symbol):
+            profile = read_cached_profile(symbol)
+            if profile is not None:
+                return profile
+            try:
+                info = yf.Ticker(symbol).info
+            except Exception as e:
+                # Warnings are raised by the caller; Streamlit calls need the script thread
+                return e
+            profile = {field: info[field] for field in PROFILE_FIELDS if field in info}
+            # Without sector/industry the quoteSummary (assetProfile) request failed and only
+            # the basic quote came back, so leave it uncached and try again on the next run
+            if 'sector' in profile or 'industry' in profile:
+                write_cached_profile(symbol, profile)
+            return profile
+        
+        unique_symbols = list(dict.fromkeys(symbols))
+        if not unique_symbols:
+            return {}
+        
+        workers = min(INFO_FETCH_WORKERS, len(unique_symbols))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(unique_symbols, executor.map(fetch_profile, unique_symbols)))
+    
+    def fetch_closing_prices(self, symbols):
+        """
+        Fetch the latest and previous closing price for all symbols in one batched request
+        
+        Args:
+            symbols (list): List of stock symbols
+            
+        Returns:
+            pd.DataFrame: 'Current Price' and 'Previous Close' indexed by symbol, omitting symbols
+                          without recent data ('Previous Close' is NaN with only one recent close)
+        """
+        import yfinance as yf
+        
+        empty = pd.DataFrame(columns=['Current Price', 'Previous Close'], dtype=float)
+        unique_symbols = list(dict.fromkeys(symbols))
+        if not unique_symbols:
+            return empty
+        
+        try:
+            data = yf.download(unique_symbols, period="5d", interval="1d", auto_adjust=True,
+                               threads=True, progress=False)
+        except Exception as e:
+            st.warning(f"Could not fetch current prices: {str(e)}")
+            return empty
+        
+        if data is None or data.empty:
+            return empty
+        
+        # Last and second-to-last valid close per symbol
+        closes = data['Close']
+        prices = pd.DataFrame({
+            'Current Price': closes.ffill().iloc[-1],
+            'Previous Close': closes.apply(lambda col: col.dropna().iloc[-2] if col.count() > 1 else np.nan)
+        })
+        return prices.dropna(subset=['Current Price'])
+    
     def get_portfolio_summary(self):
         """
         Generate comprehensive portfolio summary with current market data
@@ -147,57 +248,43 @@ class PortfolioAnalyzer:
             # Fetch current market data
             stock_data = self.fetch_stock_data(symbols)
             
-            # Create summary DataFrame
-            summary_data = []
+            # Market data per holding, in portfolio order
+            info_df = pd.DataFrame.from_dict(stock_data, orient='index').reindex(
+                index=symbols, columns=['Company Name', 'Sector', 'Current Price', 'Currency', 'Previous Close'])
+            current_price = self._float_values(info_df, 'Current Price')
+            previous_close = self._float_values(info_df, 'Previous Close')
             
-            for _, row in self.portfolio_df.iterrows():
-                symbol = row['Symbol']
-                stock_info = stock_data.get(symbol, {})
-                
-                # Basic information
-                summary_row = {
-                    'Symbol': symbol,
-                    'Company Name': stock_info.get('Company Name', symbol),
-                    'Sector': stock_info.get('Sector', 'Unknown'),
-                    'Current Price': stock_info.get('Current Price', 0),
-                    'Currency': stock_info.get('Currency', 0),
-                    'Previous Close': stock_info.get('Previous Close', 0)
-                }
-                
-                # Add shares if available
-                if 'Shares' in row and pd.notna(row['Shares']):
-                    shares = float(row['Shares'])
-                    cost_gbp = float(row['Cost (£)'])
-                    mv_gbp = float(row['Value (£)'])
-                    summary_row['Shares'] = shares
-                    summary_row['Market Value'] = shares * stock_info.get('Current Price', 0)
-                    summary_row['Cost (£)'] = cost_gbp
-                    summary_row['Value (£)'] = mv_gbp
-                    summary_row['P&L (£)'] = float(row['P&L (£)'])
-                    summary_row['P&L %'] = ((mv_gbp-cost_gbp) / cost_gbp) * 100
-                else:
-                    summary_row['Shares'] = 0
-                    summary_row['Market Value'] = 0
-                
-                # Add or calculate weights
-                if 'Weight' in row and pd.notna(row['Weight']):
-                    summary_row['Weight'] = float(row['Weight'])
-                else:
-                    # Will calculate after we have all market values
-                    summary_row['Weight'] = 0
-                
-                # Calculate daily change
-                current_price = stock_info.get('Current Price', 0)
-                previous_close = stock_info.get('Previous Close', 0)
-                if previous_close > 0:
-                    daily_change = ((current_price - previous_close) / previous_close) * 100
-                    summary_row['Daily Change (%)'] = daily_change
-                else:
-                    summary_row['Daily Change (%)'] = 0
-                
-                summary_data.append(summary_row)
+            # Basic information
+            summary_df = pd.DataFrame({
+                'Symbol': symbols,
+                'Company Name': info_df['Company Name'].to_numpy(),
+                'Sector': info_df['Sector'].to_numpy(),
+                'Current Price': current_price,
+                'Currency': info_df['Currency'].to_numpy(),
+                'Previous Close': previous_close
+            })
             
-            summary_df = pd.DataFrame(summary_data)
+            # Add shares where available
+            shares = self._float_values(self.portfolio_df, 'Shares')
+            has_shares = ~np.isnan(shares)
+            summary_df['Shares'] = np.where(has_shares, shares, 0)
+            summary_df['Market Value'] = np.where(has_shares, shares * current_price, 0)
+            if has_shares.any():
+                cost_gbp = np.where(has_shares, self._float_values(self.portfolio_df, 'Cost (£)'), np.nan)
+                mv_gbp = np.where(has_shares, self._float_values(self.portfolio_df, 'Value (£)'), np.nan)
+                summary_df['Cost (£)'] = cost_gbp
+                summary_df['Value (£)'] = mv_gbp
+                summary_df['P&L (£)'] = np.where(has_shares, self._float_values(self.portfolio_df, 'P&L (£)'), np.nan)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    summary_df['P&L %'] = ((mv_gbp - cost_gbp) / cost_gbp) * 100
+            
+            # Add provided weights (missing ones are calculated after we have all market values)
+            summary_df['Weight'] = np.nan_to_num(self._float_values(self.portfolio_df, 'Weight'), nan=0.0)
+            
+            # Calculate daily change
+            with np.errstate(divide='ignore', invalid='ignore'):
+                daily_change = ((current_price - previous_close) / previous_close) * 100
+            summary_df['Daily Change (%)'] = np.where(previous_close > 0, daily_change, 0)
             
             # Calculate weights if not provided
             if 'Weight' in summary_df.columns and summary_df['Weight'].sum() == 0:
@@ -213,7 +300,8 @@ class PortfolioAnalyzer:
                 if 'Symbol' in summary_df.columns:
                     symbols_for_analysis = summary_df['Symbol'].tolist()
                     # Use last 3 years of data for analysis
-                    analysis_results = analyze_tickers(symbols_for_analysis, start="2021-01-01")
+                    analysis_results = analyze_tickers(
+                        load_daily_histories(symbols_for_analysis, start="2021-01-01"))
                     
                     if not analysis_results.empty:
                         # Merge analysis results with portfolio summary
@@ -241,21 +329,10 @@ class PortfolioAnalyzer:
                 summary_df['Confidence'] = 50
                 summary_df['Monthly Notes'] = 'Unknown'
             
-            # Format numeric columns
-            if 'Current Price' in summary_df.columns:
-                summary_df['Current Price'] = summary_df['Current Price'].round(2)
-            if 'Previous Close' in summary_df.columns:
-                summary_df['Previous Close'] = summary_df['Previous Close'].round(2)
-            if 'Market Value' in summary_df.columns:
-                summary_df['Market Value'] = summary_df['Market Value'].round(2)
+            # Format numeric columns in a single rounding pass
             if 'Weight' in summary_df.columns:
-                summary_df['Weight (%)'] = (summary_df['Weight'] * 100).round(2)
-            if 'Daily Change (%)' in summary_df.columns:
-                summary_df['Daily Change (%)'] = summary_df['Daily Change (%)'].round(2)
-            if 'P&L %' in summary_df.columns:
-                summary_df['P&L %'] = summary_df['P&L %'].round(2)
-            if 'P&L (£)' in summary_df.columns:
-                summary_df['P&L (£)'] = summary_df['P&L (£)'].round(2)
+                summary_df['Weight (%)'] = summary_df['Weight'] * 100
+            summary_df = summary_df.round({col: 2 for col in ROUNDED_COLUMNS})
                 
             return summary_df
             
@@ -263,6 +340,22 @@ class PortfolioAnalyzer:
             st.error(f"Error generating portfolio summary: {str(e)}")
             return None
     
+    @staticmethod
+    def _float_values(df, column):
+        """
+        Read a column as a float array
+        
+        Args:
+            df (pd.DataFrame): Frame to read from
+            column (str): Column name
+            
+        Returns:
+            np.ndarray: Column values as float64, NaN where missing (all NaN if the column is absent)
+        """
+        if column not in df.columns:
+            return np.full(len(df), np.nan)
+        return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    
     def get_portfolio_metrics(self, summary_df):
         """
         Calculate key portfolio metrics
@@ -282,18 +375,21 @@ class PortfolioAnalyzer:
             
             # Concentration metrics
             if 'Weight' in summary_df.columns:
-                weights = summary_df['Weight']
-                metrics['Largest Position'] = weights.max()
-                metrics['Smallest Position'] = weights.min()
-                metrics['Concentration Ratio (Top 3)'] = weights.nlargest(3).sum()
+                weights = summary_df['Weight'].to_numpy(dtype=float)
+                weights = weights[~np.isnan(weights)]
+                metrics['Largest Position'] = weights.max() if len(weights) else np.nan
+                metrics['Smallest Position'] = weights.min() if len(weights) else np.nan
+                # Partial sort: only the three largest weights need ordering
+                metrics['Concentration Ratio (Top 3)'] = np.partition(weights, -3)[-3:].sum() if len(weights) > 3 else weights.sum()
                 
                 # Diversification metrics (Herfindahl Index)
-                metrics['Herfindahl Index'] = (weights ** 2).sum()
+                metrics['Herfindahl Index'] = float(np.dot(weights, weights))
                 metrics['Effective Number of Holdings'] = 1 / metrics['Herfindahl Index'] if metrics['Herfindahl Index'] > 0 else 0
             
             # Performance metrics
             if 'Daily Change (%)' in summary_df.columns and 'Weight' in summary_df.columns:
-                weighted_return = (summary_df['Daily Change (%)'] * summary_df['Weight']).sum()
+                weighted_return = np.nansum(summary_df['Daily Change (%)'].to_numpy(dtype=float) *
+                                            summary_df['Weight'].to_numpy(dtype=float))
                 metrics['Portfolio Daily Return (%)'] = weighted_return
             
             # Sector diversification
@@ -1,8 +1,11 @@
 import pandas as pd
 import numpy as np
-import yfinance as yf
 from typing import Optional, Tuple
 
+# Resampling offsets for the weekly and monthly MACD views, parsed once at import
+WEEKLY_OFFSET = pd.tseries.frequencies.to_offset('W')
+MONTHLY_OFFSET = pd.tseries.frequencies.to_offset('ME')
+
 def calculate_ema(prices: pd.Series, period: int) -> pd.Series:
     """
     Calculate Exponential Moving Average (EMA)
@@ -63,23 +66,63 @@ def calculate_macd(prices: pd.Series, fast_period: int = 12, slow_period: int =
         print(f"Error calculating MACD: {str(e)}")
         return None
 
+def calculate_macd_signals(closes: pd.DataFrame, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9) -> pd.Series:
+    """
+    Calculate the latest MACD crossover state for many symbols in one vectorized pass
+    
+    Each column is treated like its own price series: missing values (such as dates only
+    other symbols traded on) are skipped rather than decayed across. On gap-free series the
+    results match calculate_macd() run per symbol; calculate_macd() keeps pandas' default
+    ignore_na=False and counts NaN rows towards slow_period, so the two can disagree when a
+    symbol's own history has internal gaps.
+    
+    Args:
+        closes (pd.DataFrame): Closing prices with one column per symbol
+        fast_period (int): Fast EMA period (default: 12)
+        slow_period (int): Slow EMA period (default: 26)
+        signal_period (int): Signal line EMA period (default: 9)
+        
+    Returns:
+        pd.Series: True where the latest MACD is above its signal line, indexed by symbol
+                   (symbols with fewer than slow_period prices are omitted)
+    """
+    if closes.empty:
+        return pd.Series(dtype=bool)
+    
+    valid = closes.notna()
+    ema_fast = closes.ewm(span=fast_period, adjust=False, ignore_na=True).mean()
+    ema_slow = closes.ewm(span=slow_period, adjust=False, ignore_na=True).mean()
+    
+    # Mask gaps so the signal EMA only sees each symbol's own data points
+    macd_line = (ema_fast - ema_slow).where(valid)
+    signal_line = macd_line.ewm(span=signal_period, adjust=False, ignore_na=True).mean().where(valid)
+    
+    # Latest MACD and signal value per symbol
+    latest_macd = macd_line.ffill().iloc[-1]
+    latest_signal = signal_line.ffill().iloc[-1]
+    
+    enough_data = valid.sum() >= slow_period
+    return (latest_macd > latest_signal)[enough_data]
+
 def analyze_macd(macd, signal, hist, price, label):
+    """Score one timeframe's MACD from its arrays (only the last 20 values are inspected)"""
     try:
+        macd = np.asarray(macd, dtype=float)
+        signal = np.asarray(signal, dtype=float)
+        hist = np.asarray(hist, dtype=float)
+        price = np.asarray(price, dtype=float)
+        
         # Validate inputs
-        if (macd.empty or signal.empty or hist.empty or price.empty or 
-            len(macd) < 2 or len(signal) < 2 or len(hist) < 2 or len(price) < 20):
+        if len(macd) < 2 or len(signal) < 2 or len(hist) < 2 or len(price) < 20:
             return {"Outlook": "Neutral", "Score": 0, "Notes": ["Insufficient data"], "Label": label}
             
         notes = []
         score = 0
 
-        # Convert to float values to avoid Series ambiguity
-        macd_last = float(macd.iloc[-1])
-        macd_prev = float(macd.iloc[-2]) 
-        signal_last = float(signal.iloc[-1])
-        signal_prev = float(signal.iloc[-2])
-        hist_last = float(hist.iloc[-1])
-        hist_prev = float(hist.iloc[-2])
+        # Latest and previous values as plain floats
+        macd_last, macd_prev = macd[-1], macd[-2]
+        signal_last, signal_prev = signal[-1], signal[-2]
+        hist_last, hist_prev = hist[-1], hist[-2]
 
         # Basic position
         if macd_last > signal_last and macd_last > 0:
@@ -107,13 +150,15 @@ def analyze_macd(macd, signal, hist, price, label):
             notes.append("Momentum weakening")
             score -= 1
 
-        # Divergence check (simplified) - convert to float values
-        try:
-            price_current = float(price.iloc[-1])
-            price_high = float(price.iloc[-20:].max())
-            price_low = float(price.iloc[-20:].min())
-            macd_high = float(macd.iloc[-20:].max())
-            macd_low = float(macd.iloc[-20:].min())
+        # Divergence check (simplified) over the last 20 bars, skipping missing values
+        recent_price = price[-20:]
+        recent_macd = macd[-20:]
+        if not (np.isnan(recent_price).all() or np.isnan(recent_macd).all()):
+            price_current = price[-1]
+            price_high = np.nanmax(recent_price)
+            price_low = np.nanmin(recent_price)
+            macd_high = np.nanmax(recent_macd)
+            macd_low = np.nanmin(recent_macd)
 
             if price_current > price_high and macd_last < macd_high:
                 notes.append("Bearish divergence (price high not confirmed by MACD)")
@@ -121,9 +166,6 @@ def analyze_macd(macd, signal, hist, price, label):
             if price_current < price_low and macd_last > macd_low:
                 notes.append("Bullish divergence (price low not confirmed by MACD)")
                 score += 2
-        except (ValueError, TypeError):
-            # Skip divergence analysis if conversion fails
-            pass
 
         # Translate score into ranked outlook
         if score >= 3:
@@ -144,10 +186,11 @@ def analyze_macd(macd, signal, hist, price, label):
         return {"Outlook": "Neutral", "Score": 0, "Notes": [f"Analysis error: {str(e)}"], "Label": label}
 
 def compute_macd(prices, fast=12, slow=26, signal=9):
-    """Compute MACD and return separate series (used by analyze_tickers)"""
+    """Compute MACD and return separate NaN-free arrays (used by analyze_tickers)"""
+    empty = np.array([])
     try:
         if len(prices) < slow:
-            return pd.Series(), pd.Series(), pd.Series()
+            return empty, empty, empty
         
         # Calculate EMAs
         ema_fast = prices.ewm(span=fast).mean()
@@ -159,14 +202,17 @@ def compute_macd(prices, fast=12, slow=26, signal=9):
         # Signal line
         signal_line = macd_line.ewm(span=signal).mean()
         
-        # Histogram
-        histogram = macd_line - signal_line
+        # Histogram on the raw arrays, without building another Series
+        macd_values = macd_line.to_numpy()
+        signal_values = signal_line.to_numpy()
+        histogram = macd_values - signal_values
         
-        return macd_line.dropna(), signal_line.dropna(), histogram.dropna()
+        return (macd_values[~np.isnan(macd_values)], signal_values[~np.isnan(signal_values)],
+                histogram[~np.isnan(histogram)])
     
     except Exception as e:
         print(f"Error in compute_macd: {e}")
-        return pd.Series(), pd.Series(), pd.Series()
+        return empty, empty, empty
 
 def interpret_macd(price_df):
     """Interpret weekly and monthly MACD with ranking and confidence scoring."""
@@ -174,8 +220,9 @@ def interpret_macd(price_df):
         if price_df is None or price_df.empty or len(price_df) < 50:
             return None
             
-        weekly = price_df['Close'].resample('W').last()
-        monthly = price_df['Close'].resample('ME').last()
+        close = price_df['Close']
+        weekly = close.resample(WEEKLY_OFFSET).last()
+        monthly = close.resample(MONTHLY_OFFSET).last()
         
         # Make sure we have enough data points
         if len(weekly) < 10 or len(monthly) < 5:
@@ -185,11 +232,11 @@ def interpret_macd(price_df):
         macd_m, sig_m, hist_m = compute_macd(monthly)
         
         # Check if MACD calculation was successful
-        if macd_w.empty or sig_w.empty or hist_w.empty or macd_m.empty or sig_m.empty or hist_m.empty:
+        if min(len(macd_w), len(sig_w), len(hist_w), len(macd_m), len(sig_m), len(hist_m)) == 0:
             return None
 
-        weekly_view = analyze_macd(macd_w, sig_w, hist_w, weekly, "Weekly")
-        monthly_view = analyze_macd(macd_m, sig_m, hist_m, monthly, "Monthly")
+        weekly_view = analyze_macd(macd_w, sig_w, hist_w, weekly.to_numpy(), "Weekly")
+        monthly_view = analyze_macd(macd_m, sig_m, hist_m, monthly.to_numpy(), "Monthly")
     except Exception as e:
         print(f"Error in interpret_macd: {e}")
         return None
@@ -220,11 +267,12 @@ def interpret_macd(price_df):
     }
 
 # --- Multi-ticker wrapper ---
-def analyze_tickers(tickers, start="2020-01-01"):
+def analyze_tickers(histories):
+    """Score every ticker's daily history (dict of ticker to OHLCV DataFrame), best first"""
     results = []
-    for ticker in tickers:
+    
+    for ticker, df in histories.items():
         try:
-            df = yf.download(ticker, start=start, progress=False)
             if df is None or df.empty:
                 continue
             